@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
 from weakref import WeakKeyDictionary
 from collections import OrderedDict
 from typing import Callable
 import numpy as np
+import functools
 import threading
-import binascii
 import logging
 import ctypes
 import time
@@ -15,6 +16,12 @@ from . import constants
 from . import util
 from . import csi
 
+# Number of slots in the direct-mapped lookup table for over-the-air clusters, must be a power of two
+_OTA_RING_SIZE = 256
+
+# Maximum number of ClusteredCSI objects that are kept for reuse after they were removed from the over-the-air cache
+_CLUSTER_FREELIST_SIZE = 64
+
 class ClusteredCSI(object):
     """
         A ClusteredCSI object represents a collection of CSI data estimated for the same WiFi packet.
@@ -23,6 +30,11 @@ class ClusteredCSI(object):
         It is used to store CSI data until it is complete and can be provided to a callback.
         CSI data may be from calibration packets or over-the-air packets.
     """
+    # __weakref__ is required since callbacks track their fired state in a WeakKeyDictionary
+    __slots__ = ("source_mac", "dest_mac", "seq_ctrl", "timestamp", "boardcount", "shape",
+                 "csi_completion_state", "csi_completion_state_all", "complex_csi_all", "complex_csi_lltf",
+                 "complex_csi_htltf_higher", "complex_csi_htltf_lower", "rssi_all", "noise_floor_all", "sensor_timestamps_all", "_completion_count", "_first_rx_ctrl", "__weakref__")
+
     def __init__(self, source_mac: str, dest_mac: str, seq_ctrl: csi.seq_ctrl_t, boardcount: int):
         """
         Constructor for the ClusteredCSI class.
@@ -36,28 +48,51 @@ class ClusteredCSI(object):
         :param seq_ctrl: The sequence control field of the WiFi packet
         :param boardcount: The number of ESPARGOS boards in the pool
         """
-        self.source_mac = source_mac
-        self.dest_mac = dest_mac
-        self.seq_ctrl = seq_ctrl
-
-        self.timestamp = time.time()
         self.boardcount = boardcount
-        self.serialized_csi_all = [[[None for c in range(constants.ANTENNAS_PER_ROW)] for r in range(constants.ROWS_PER_BOARD)] for b in range(self.boardcount)]
         self.shape = (self.boardcount, constants.ROWS_PER_BOARD, constants.ANTENNAS_PER_ROW)
 
         # Remember which sensors have already provided CSI data
-        self.csi_completion_state = np.full(self.shape, False)
-        self.csi_completion_state_all = False
+        self.csi_completion_state = np.empty(self.shape, dtype = bool)
 
         # Allocate memory for the channel coefficients and build views for the different parts of them
-        self.complex_csi_all = np.full(self.shape + (ctypes.sizeof(csi.csi_buf_t) // 2, ), fill_value = np.nan, dtype = np.complex64)
+        self.complex_csi_all = np.empty(self.shape + (ctypes.sizeof(csi.csi_buf_t) // 2, ), dtype = np.complex64)
         self.complex_csi_lltf = self.complex_csi_all[:,:,:,csi.csi_buf_t.lltf.offset // 2:(csi.csi_buf_t.lltf.offset + csi.csi_buf_t.lltf.size) // 2].view()
         self.complex_csi_htltf_higher = self.complex_csi_all[:,:,:,csi.csi_buf_t.htltf_higher.offset // 2:(csi.csi_buf_t.htltf_higher.offset + csi.csi_buf_t.htltf_higher.size) // 2].view()
         self.complex_csi_htltf_lower = self.complex_csi_all[:,:,:,csi.csi_buf_t.htltf_lower.offset // 2:(csi.csi_buf_t.htltf_lower.offset + csi.csi_buf_t.htltf_lower.size) // 2].view()
 
         # Allocate memory for the RSSI and noise floor values
-        self.rssi_all = np.full(self.shape, fill_value = np.nan, dtype = np.float32)
-        self.noise_floor_all = np.full(self.shape, fill_value = np.nan, dtype = np.float32)
+        self.rssi_all = np.empty(self.shape, dtype = np.float32)
+        self.noise_floor_all = np.empty(self.shape, dtype = np.float32)
+
+        # Allocate memory for the (nanosecond-precision) sensor timestamps, in seconds
+        self.sensor_timestamps_all = np.empty(self.shape, dtype = np.float128)
+
+        self.reset(source_mac, dest_mac, seq_ctrl)
+
+    def reset(self, source_mac: str, dest_mac: str, seq_ctrl: csi.seq_ctrl_t):
+        """
+        Discard all CSI data and prepare the cluster for a different WiFi packet, reusing the pre-allocated memory.
+
+        :param source_mac: The source MAC address of the WiFi packet
+        :param dest_mac: The destination MAC address of the WiFi packet
+        :param seq_ctrl: The sequence control field of the WiFi packet
+        """
+        self.source_mac = source_mac
+        self.dest_mac = dest_mac
+        self.seq_ctrl = seq_ctrl
+        self.timestamp = time.time()
+
+        self.csi_completion_state.fill(False)
+        self.csi_completion_state_all = False
+        self._completion_count = 0
+
+        # complex_csi_all is not cleared here, CSI of sensors that have not provided data is masked when it is read
+        self.rssi_all.fill(np.nan)
+        self.noise_floor_all.fill(np.nan)
+        self.sensor_timestamps_all.fill(np.nan)
+
+        # (cwb, secondary_channel, channel) fields of the rx_ctrl of the first sensor that provided CSI
+        self._first_rx_ctrl = None
 
     def add_csi(self, board_num: int, esp_num: int, serialized_csi: csi.serialized_csi_t, csi_cplx: np.ndarray):
         """
@@ -68,8 +103,8 @@ class ClusteredCSI(object):
         :param serialized_csi: The serialized CSI data
         :param csi_cplx: The complex-valued CSI data
         """
-        assert(binascii.hexlify(bytearray(serialized_csi.source_mac)).decode("utf-8") == self.source_mac)
-        assert(binascii.hexlify(bytearray(serialized_csi.dest_mac)).decode("utf-8") == self.dest_mac)
+        assert(bytes(serialized_csi.source_mac).hex() == self.source_mac)
+        assert(bytes(serialized_csi.dest_mac).hex() == self.dest_mac)
         assert(serialized_csi.seq_ctrl.seg == self.seq_ctrl.seg)
         assert(serialized_csi.seq_ctrl.frag == self.seq_ctrl.frag)
 
@@ -78,12 +113,19 @@ class ClusteredCSI(object):
         column = 3 - esp_num % 4
 
         # Store CSI data to pre-allocated memory
-        self.serialized_csi_all[board_num][row][column] = serialized_csi
         self.complex_csi_all[board_num, row, column] = csi_cplx
-        self.csi_completion_state[board_num, row, column] = True
-        self.csi_completion_state_all = np.all(self.csi_completion_state)
-        self.rssi_all[board_num, row, column] = csi.wifi_pkt_rx_ctrl_t(serialized_csi.rx_ctrl).rssi
-        self.noise_floor_all[board_num, row, column] = csi.wifi_pkt_rx_ctrl_t(serialized_csi.rx_ctrl).noise_floor
+        if not self.csi_completion_state[board_num, row, column]:
+            self.csi_completion_state[board_num, row, column] = True
+            self._completion_count += 1
+            self.csi_completion_state_all = self._completion_count == self.csi_completion_state.size
+        rx_ctrl = csi.wifi_pkt_rx_ctrl_t(serialized_csi.rx_ctrl)
+        self.rssi_all[board_num, row, column] = rx_ctrl.rssi
+        self.noise_floor_all[board_num, row, column] = rx_ctrl.noise_floor
+        self.sensor_timestamps_all[board_num, row, column] = np.float128(self._nanosecond_timestamp(serialized_csi, rx_ctrl)) / 1e9
+
+        # All sensors receive the same packet, so packet properties are taken from the first sensor
+        if self._first_rx_ctrl is None:
+            self._first_rx_ctrl = (rx_ctrl.cwb, rx_ctrl.secondary_channel, rx_ctrl.channel)
 
     def deserialize_csi_lltf(self):
         """
@@ -91,6 +133,7 @@ class ClusteredCSI(object):
 
         :return: The L-LTF part of the CSI data as a complex-valued numpy array of shape :code:`(boardcount, constants.ROWS_PER_BOARD, constants.ANTENNAS_PER_ROW, csi.csi_buf_t.lltf.size // 2)`
         """
+        self._mask_missing_csi()
         return self.complex_csi_lltf
 
     def deserialize_csi_ht40(self):
@@ -102,20 +145,21 @@ class ClusteredCSI(object):
         assert(self.is_ht40())
         loc = self.get_secondary_channel_relative()
         assert(loc != 0)
+        self._mask_missing_csi()
 
         csi_ht40 = np.zeros(self.shape + ((csi.csi_buf_t.htltf_lower.size + csi.HT40_GAP_SUBCARRIERS * 2 + csi.csi_buf_t.htltf_higher.size) // 2,), dtype = np.complex64)
         csi_higher = csi_ht40[:,:,:,:csi.csi_buf_t.htltf_lower.size // 2].view()
         csi_lower = csi_ht40[:,:,:,-csi.csi_buf_t.htltf_higher.size // 2:].view()
-        csi_higher[:] = self.complex_csi_htltf_lower
-        csi_lower[:] = self.complex_csi_htltf_higher
 
-        # Secondary channel experiences phase shift by pi / 2
+        # Secondary channel experiences phase shift by pi / 2, i.e., is multiplied by exp(-1.0j * np.pi / 2) = -1.0j
         # This is likely due to the pi / 2 phase shift specified for the pilot symbols,
         # see IEEE 80211-2012 section 20.3.9.3.4 L-LTF definition
         if loc == 1:
-            csi_higher[:] = csi_higher * np.exp(-1.0j * np.pi / 2)
+            np.multiply(self.complex_csi_htltf_lower, np.complex64(-1.0j), out = csi_higher)
+            csi_lower[:] = self.complex_csi_htltf_higher
         else:
-            csi_lower[:] = csi_lower * np.exp(-1.0j * np.pi / 2)
+            csi_higher[:] = self.complex_csi_htltf_lower
+            np.multiply(self.complex_csi_htltf_higher, np.complex64(-1.0j), out = csi_lower)
 
         return csi_ht40
 
@@ -123,7 +167,7 @@ class ClusteredCSI(object):
         """
         Check if the packet is a HT40 packet, i.e., if it uses channel bonding and hence occupies two 20 MHz channels.
         """
-        return csi.wifi_pkt_rx_ctrl_t(self._first_complete_sensor().rx_ctrl).cwb == 1
+        return self._first_rx_ctrl[0] == 1
 
     def get_secondary_channel_relative(self):
         """
@@ -131,7 +175,7 @@ class ClusteredCSI(object):
 
         :return: 0 if no secondary channel is used, 1 if the secondary channel is above the primary channel, -1 if the secondary channel is below the primary channel
         """
-        match csi.wifi_pkt_rx_ctrl_t(self._first_complete_sensor().rx_ctrl).secondary_channel:
+        match self._first_rx_ctrl[1]:
             case 0:
                 return 0
             case 1:
@@ -145,7 +189,7 @@ class ClusteredCSI(object):
 
         :return: The primary channel number
         """
-        return csi.wifi_pkt_rx_ctrl_t(self._first_complete_sensor().rx_ctrl).channel
+        return self._first_rx_ctrl[2]
 
     def get_secondary_channel(self) -> int:
         """
@@ -189,14 +233,7 @@ class ClusteredCSI(object):
 
         :return: A numpy array of shape :code:`(boardcount, constants.ROWS_PER_BOARD, constants.ANTENNAS_PER_ROW)` that contains the sensor timestamps in seconds
         """
-        sensor_timestamps = np.full(self.shape, np.nan, dtype = np.float128)
-
-        def append_sensor_timestamp(b, r, a, serialized_csi):
-            timestamp_ns = np.float128(self._nanosecond_timestamp(serialized_csi))
-            sensor_timestamps[b, r, a] = np.float128(timestamp_ns) / 1e9
-
-        self._foreach_complete_sensor(append_sensor_timestamp)
-        return sensor_timestamps
+        return self.sensor_timestamps_all
 
     def get_host_timestamp(self):
         """
@@ -237,25 +274,14 @@ class ClusteredCSI(object):
         return self.seq_ctrl
 
     # Internal helper functions
-    def _foreach_complete_sensor(self, cb):
-        for b, board in enumerate(self.serialized_csi_all):
-            for r, row in enumerate(board):
-                for a, serialized_csi in enumerate(row):
-                    if serialized_csi is not None:
-                        cb(b, r, a, serialized_csi)
-
-    def _first_complete_sensor(self):
-        for board in self.serialized_csi_all:
-            for row in board:
-                for serialized_csi in row:
-                    if serialized_csi is not None:
-                        return serialized_csi
-
-        return None
-    
-    def _nanosecond_timestamp(self, serialized_csi):
-        rxstart_time_cyc = csi.wifi_pkt_rx_ctrl_t(serialized_csi.rx_ctrl).rxstart_time_cyc
-        rxstart_time_cyc_dec = csi.wifi_pkt_rx_ctrl_t(serialized_csi.rx_ctrl).rxstart_time_cyc_dec
+    def _mask_missing_csi(self):
+        # The CSI buffer may contain stale data from a previous packet (or uninitialized memory), set CSI of sensors without data to NaN
+        if not self.csi_completion_state_all:
+            self.complex_csi_all[~self.csi_completion_state] = np.nan
+
+    def _nanosecond_timestamp(self, serialized_csi, rx_ctrl):
+        rxstart_time_cyc = rx_ctrl.rxstart_time_cyc
+        rxstart_time_cyc_dec = rx_ctrl.rxstart_time_cyc_dec
         rxstart_time_cyc_dec = 2048 - rxstart_time_cyc_dec if rxstart_time_cyc_dec >= 1024 else rxstart_time_cyc_dec
 
         # Backwards compatibility: Only use global timestamp if it is nonzero
@@ -272,7 +298,69 @@ class ClusteredCSI(object):
         HW_TIMESTAMP_LAG_NS = 20800
         return hw_latched_timestamp_ns - HW_TIMESTAMP_LAG_NS + rxstart_time_cyc * CYC_PERIOD_NS + rxstart_time_cyc_dec * CYC_DEC_PERIOD_NS
 
+def _mean_sto(csi: np.ndarray):
+    """
+    Estimate the mean symbol timing offset of the provided CSI data, i.e., the phase rotation between adjacent subcarriers averaged over all antennas.
+    Antennas without CSI (NaN values) are ignored.
+
+    :param csi: The CSI data, as a complex-valued numpy array of arbitrary shape, but the last dimension must be the subcarriers
+    :return: The mean symbol timing offset, in cycles per subcarrier
+    """
+    # Sum of csi[..., s + 1] * conj(csi[..., s]) as one dot product over the flattened array, which does not materialize the products.
+    # The dot product also includes the products across antenna boundaries, these are subtracted again.
+    flat = np.ravel(csi)
+    n = csi.shape[-1]
+    acc = np.vdot(flat[:-1], flat[1:]) - np.vdot(flat[n - 1:-1:n], flat[n::n])
+
+    # NaN values propagate through the dot product, so fall back to NaN-aware summation if some sensors did not provide CSI
+    if np.isnan(acc):
+        acc = np.nansum(csi[...,1:] * np.conj(csi[...,:-1]))
+
+    return np.angle(acc) / (2 * np.pi)
+
+def _phase_ramp(cycles, first: float, count: int) -> np.ndarray:
+    """
+    Compute the linear phase ramp :code:`exp(-1.0j * 2 * np.pi * cycles * k)` for :code:`k = first, ..., first + count - 1`.
+    Since neighboring elements only differ by a constant factor, the ramp is computed as a cumulative product,
+    which requires two complex exponentials per ramp instead of one per element.
+
+    :param cycles: The phase increment between neighboring elements, in cycles, scalar or numpy array of arbitrary shape
+    :param first: The value of :code:`k` for the first element of the ramp
+    :param count: The number of elements of the ramp
+    :return: The phase ramp, as a complex-valued numpy array of shape :code:`np.shape(cycles) + (count,)`
+    """
+    cycles = np.asarray(cycles)
+    ramp = np.empty(cycles.shape + (count,), dtype = np.complex64)
+    ramp[...,0] = np.exp(-1.0j * 2 * np.pi * cycles * first)
+    ramp[...,1:] = np.exp(-1.0j * 2 * np.pi * cycles)[...,np.newaxis]
+    return np.cumprod(ramp, axis = -1, out = ramp)
+
+@functools.lru_cache(maxsize = 16)
+def _calib_trace_phases(channel_primary: int, channel_secondary: int):
+    """
+    Compute the phases of the calibration signal due to propagation along the calibration traces.
+    Only depends on the channel, so the result is cached and hence read-only.
+
+    :param channel_primary: The primary channel number
+    :param channel_secondary: The secondary channel number
+    :return: The L-LTF and HT40 propagation phases, as float32 numpy arrays of shape :code:`(constants.ROWS_PER_BOARD, constants.ANTENNAS_PER_ROW, subcarriers)`
+    """
+    # Phases are computed in single precision, so that the resulting phasors are complex64 just like the CSI
+    wavelengths_lltf = util.get_calib_trace_wavelength(util.get_frequencies_lltf(channel_primary)).astype(np.float32)
+    wavelengths_ht40 = util.get_calib_trace_wavelength(util.get_frequencies_ht40(channel_primary, channel_secondary)).astype(np.float32)
+    tracelengths = np.asarray(constants.CALIB_TRACE_LENGTH, dtype = np.float32)# - np.asarray(constants.CALIB_TRACE_EMPIRICAL_ERROR)
+
+    prop_phase_lltf = np.float32(-2 * np.pi) * tracelengths[:,:,np.newaxis] / wavelengths_lltf[np.newaxis, np.newaxis]
+    prop_phase_ht40 = np.float32(-2 * np.pi) * tracelengths[:,:,np.newaxis] / wavelengths_ht40[np.newaxis, np.newaxis]
+    prop_phase_lltf.flags.writeable = False
+    prop_phase_ht40.flags.writeable = False
+
+    return prop_phase_lltf, prop_phase_ht40
+
 class CSICalibration(object):
+    __slots__ = ("channel_primary", "channel_secondary", "frequencies_lltf", "frequencies_ht40", "receiver_lo_freq",
+                 "calibration_values_lltf", "calibration_values_ht40", "timestamp_calibration_values")
+
     def __init__(self,
                  channel_primary: int,
                  channel_secondary: int,
@@ -301,37 +389,31 @@ class CSICalibration(object):
         self.channel_secondary = channel_secondary
         self.frequencies_lltf = util.get_frequencies_lltf(self.channel_primary)
         self.frequencies_ht40 = util.get_frequencies_ht40(self.channel_primary, self.channel_secondary)
-        wavelengths_lltf = util.get_calib_trace_wavelength(self.frequencies_lltf).astype(calibration_values_lltf.dtype)
-        wavelengths_ht40 = util.get_calib_trace_wavelength(self.frequencies_ht40).astype(calibration_values_ht40.dtype)
-        tracelengths = np.asarray(constants.CALIB_TRACE_LENGTH, dtype = calibration_values_ht40.dtype)# - np.asarray(constants.CALIB_TRACE_EMPIRICAL_ERROR)
-        prop_calib_each_board_lltf = np.exp(-1.0j * 2 * np.pi * tracelengths[:,:,np.newaxis] / wavelengths_lltf[np.newaxis, np.newaxis])
-        prop_calib_each_board_ht40 = np.exp(-1.0j * 2 * np.pi * tracelengths[:,:,np.newaxis] / wavelengths_ht40[np.newaxis, np.newaxis])
+
+        # Phase of the calibration signal due to propagation along the calibration traces, shape (rows, antennas, subcarriers)
+        prop_phase_lltf, prop_phase_ht40 = _calib_trace_phases(self.channel_primary, self.channel_secondary)
         prop_delay_each_board = np.asarray(constants.CALIB_TRACE_LENGTH) / np.asarray(constants.CALIB_TRACE_GROUP_VELOCITY)
         self.receiver_lo_freq = constants.WIFI_CHANNEL1_FREQUENCY + constants.WIFI_CHANNEL_SPACING * ((channel_primary + channel_secondary) / 2 - 1)
 
         # Account for additional board-specific phase offsets due to different feeder cable lengths in a multi-board antenna array system
         if board_cable_lengths is not None:
             assert(board_cable_vfs is not None)
-            board_cable_lengths = np.asarray(board_cable_lengths)
+            board_cable_lengths = np.asarray(board_cable_lengths, dtype = np.float32)
             board_cable_vfs = np.asarray(board_cable_vfs)
 
-            subcarrier_cable_wavelengths_lltf = util.get_cable_wavelength(util.get_frequencies_lltf(channel_primary), board_cable_vfs).astype(calibration_values_lltf.dtype)
-            subcarrier_cable_wavelengths_ht40 = util.get_cable_wavelength(util.get_frequencies_ht40(channel_primary, channel_secondary), board_cable_vfs).astype(calibration_values_ht40.dtype)
-
-            board_phase_offsets_lltf = np.exp(-1.0j * 2 * np.pi * board_cable_lengths[:,np.newaxis] / subcarrier_cable_wavelengths_lltf)
-            board_phase_offsets_ht40 = np.exp(-1.0j * 2 * np.pi * board_cable_lengths[:,np.newaxis] / subcarrier_cable_wavelengths_ht40)
+            subcarrier_cable_wavelengths_lltf = util.get_cable_wavelength(self.frequencies_lltf, board_cable_vfs).astype(np.float32)
+            subcarrier_cable_wavelengths_ht40 = util.get_cable_wavelength(self.frequencies_ht40, board_cable_vfs).astype(np.float32)
 
-            prop_calib_lltf = np.einsum("bs,ras->bras", board_phase_offsets_lltf, prop_calib_each_board_lltf)
-            prop_calib_ht40 = np.einsum("bs,ras->bras", board_phase_offsets_ht40, prop_calib_each_board_ht40)
+            # Add phase due to propagation along the feeder cables, resulting phase has shape (boardcount, rows, antennas, subcarriers)
+            prop_phase_lltf = prop_phase_lltf - np.float32(2 * np.pi) * (board_cable_lengths[:,np.newaxis] / subcarrier_cable_wavelengths_lltf)[:,np.newaxis,np.newaxis,:]
+            prop_phase_ht40 = prop_phase_ht40 - np.float32(2 * np.pi) * (board_cable_lengths[:,np.newaxis] / subcarrier_cable_wavelengths_ht40)[:,np.newaxis,np.newaxis,:]
 
-            coeffs_without_propdelay_lltf = np.einsum("bras,bras->bras", calibration_values_lltf, np.conj(prop_calib_lltf))
-            coeffs_without_propdelay_ht40 = np.einsum("bras,bras->bras", calibration_values_ht40, np.conj(prop_calib_ht40))
-        else:
-            coeffs_without_propdelay_lltf = np.einsum("bras,ras->bras", calibration_values_lltf, np.conj(prop_calib_each_board_lltf))
-            coeffs_without_propdelay_ht40 = np.einsum("bras,ras->bras", calibration_values_ht40, np.conj(prop_calib_each_board_ht40))
+        # Remove propagation phase from the measured calibration values, i.e., multiply by the complex conjugate of the propagation term
+        coeffs_without_propdelay_lltf = calibration_values_lltf * np.exp(-1.0j * prop_phase_lltf)
+        coeffs_without_propdelay_ht40 = calibration_values_ht40 * np.exp(-1.0j * prop_phase_ht40)
 
-        self.calibration_values_lltf: np.ndarray = np.exp(-1.0j * np.angle(coeffs_without_propdelay_lltf))
-        self.calibration_values_ht40: np.ndarray = np.exp(-1.0j * np.angle(coeffs_without_propdelay_ht40))
+        self.calibration_values_lltf: np.ndarray = util._conj_unit_phasor_inplace(coeffs_without_propdelay_lltf)
+        self.calibration_values_ht40: np.ndarray = util._conj_unit_phasor_inplace(coeffs_without_propdelay_ht40)
 
         self.timestamp_calibration_values = timestamp_calibration_values - prop_delay_each_board[np.newaxis,:,:]
 
@@ -346,17 +428,18 @@ class CSICalibration(object):
         """
         # TODO: Check if primary and secondary channel match
 
+        # Timestamps need 128 bit precision, but the delays relative to the mean delay are small.
+        # 32 bit delay is sufficient for the phase correction, CSI is only 2x32 bit.
         delay = sensor_timestamps - self.timestamp_calibration_values
-        delay = delay - np.nanmean(delay)
+        delay = (delay - np.nanmean(delay)).astype(np.float32)
 
-        subcarrier_range = np.arange(-values.shape[-1] // 2, values.shape[-1] // 2)[np.newaxis,np.newaxis,np.newaxis,:]
-        # 128 bit delay is overkill here, CSI is only 2x32 bit, product would be 2x128 bit
-        sto_delay_correction = np.exp(-1.0j * 2 * np.pi * delay[:,:,:,np.newaxis] * constants.WIFI_SUBCARRIER_SPACING * subcarrier_range).astype(np.complex64)
-        csi = np.einsum("bras,bras,bras->bras", values, sto_delay_correction, self.calibration_values_ht40)
+        # Per-antenna phase ramp over subcarriers -values.shape[-1] // 2, ..., values.shape[-1] // 2 - 1
+        sto_delay_correction = _phase_ramp(delay * np.float32(constants.WIFI_SUBCARRIER_SPACING), -values.shape[-1] // 2, values.shape[-1])
+        csi = values * sto_delay_correction * self.calibration_values_ht40
 
         # Mean delay should be zero
-        mean_sto = np.angle(np.nansum(csi[...,1:] * np.conj(csi[...,:-1]))) / (2 * np.pi)
-        mean_sto_correction = np.exp(-1.0j * 2 * np.pi * mean_sto * np.arange(-csi.shape[-1] // 2, csi.shape[-1] // 2)).astype(np.complex64)
+        mean_sto = _mean_sto(csi)
+        mean_sto_correction = _phase_ramp(mean_sto, -csi.shape[-1] // 2, csi.shape[-1])
         return csi * mean_sto_correction[np.newaxis, np.newaxis, np.newaxis, :]
 
     def apply_lltf(self, values: np.ndarray, sensor_timestamps: np.ndarray) -> np.ndarray:
@@ -373,21 +456,21 @@ class CSICalibration(object):
         # In all steps, we have to account for the csi values and timestamps that are NaN.
         # Therefore: np.nanmean and np.nansum instead of np.mean and np.sum
         # This indicates that one particular sensor has not yet provided the packet
+        # 32 bit delay relative to the mean delay is sufficient for the phase correction, CSI is only 2x32 bit
         delay = sensor_timestamps - self.timestamp_calibration_values
-        delay = delay - np.nanmean(delay)
+        delay = (delay - np.nanmean(delay)).astype(np.float32)
 
         # Apply phase correction due to CFO. Depends on whether receiver LO is above / below primary channel (assumes HT40 calibration)
         # TODO: Check if this STO compensation really matches what happens in hardware
-        subcarrier_frequency_offsets = util.get_frequencies_lltf(self.channel_primary) - self.receiver_lo_freq
-
-        # 128 bit delay is overkill here, CSI is only 2x32 bit, product would be 2x128 bit
-        sto_delay_correction = np.exp(-1.0j * 2 * np.pi * delay[:,:,:,np.newaxis] * subcarrier_frequency_offsets).astype(np.complex64)
+        # Subcarrier frequency offsets are evenly spaced, so the correction is a per-antenna phase ramp
+        first_subcarrier_offset = (self.frequencies_lltf[0] - self.receiver_lo_freq) / constants.WIFI_SUBCARRIER_SPACING
+        sto_delay_correction = _phase_ramp(delay * np.float32(constants.WIFI_SUBCARRIER_SPACING), first_subcarrier_offset, values.shape[-1])
 
-        csi = np.einsum("bras,bras,bras->bras", values, sto_delay_correction, self.calibration_values_lltf)
+        csi = values * sto_delay_correction * self.calibration_values_lltf
 
         # Mean delay should be zero
-        mean_sto = np.angle(np.nansum(csi[...,1:] * np.conj(csi[...,:-1]))) / (2 * np.pi)
-        mean_sto_correction = np.exp(-1.0j * 2 * np.pi * mean_sto * np.arange(-csi.shape[-1] // 2, csi.shape[-1] // 2)).astype(np.complex64)
+        mean_sto = _mean_sto(csi)
+        mean_sto_correction = _phase_ramp(mean_sto, -csi.shape[-1] // 2, csi.shape[-1])
         return csi * mean_sto_correction[np.newaxis, np.newaxis, np.newaxis, :]
 
     def apply_timestamps(self, timestamps: np.ndarray):
@@ -400,6 +483,8 @@ class CSICalibration(object):
         return timestamps - self.timestamp_calibration_values
 
 class _CSICallback(object):
+    __slots__ = ("cb_predicate", "cb", "fired")
+
     def __init__(self, cb: Callable[[ClusteredCSI], None], cb_predicate: Callable[[np.ndarray, float], bool] = None):
         # By default, provide csi if CSI is available from all antennas
         self.cb_predicate = cb_predicate
@@ -454,8 +539,20 @@ class Pool(object):
         self.ota_cache_timeout = ota_cache_timeout
 
         # We have two caches: One for calibration packets, the other one for over-the-air packets
-        self.cluster_cache_calib = OrderedDict[str, ClusteredCSI]()
-        self.cluster_cache_ota = OrderedDict[str, ClusteredCSI]()
+        # Clusters are identified by (source MAC, destination MAC, sequence number, fragment number), MACs as raw bytes
+        self.cluster_cache_calib = OrderedDict[tuple, ClusteredCSI]()
+        self.cluster_cache_ota = OrderedDict[tuple, ClusteredCSI]()
+
+        # Direct-mapped lookup table in front of the over-the-air cache, indexed by the lower bits of the sequence number.
+        # Consecutive packets almost always belong to a recently created cluster, so most lookups do not need to hash the cluster identifier.
+        # Colliding clusters simply remain reachable through cluster_cache_ota.
+        self._ota_ring: list[tuple[tuple, ClusteredCSI]] = [None] * _OTA_RING_SIZE
+
+        # ClusteredCSI objects removed from the over-the-air cache are reused, which saves reallocating their buffers
+        self._cluster_freelist: list[ClusteredCSI] = []
+
+        # Scratch buffer for the complex-valued CSI of a batch of packets, grows with the largest batch seen so far
+        self._csi_scratch = np.empty((0, ctypes.sizeof(csi.csi_buf_t) // 2), dtype = np.complex64)
 
         self.input_list = list()
         self.input_cond = threading.Condition()
@@ -520,6 +617,9 @@ class Pool(object):
             If :code:`cb_predicate` returns true, clustered CSI is regarded as completed.
             If no predicate is provided, the default behavior is to trigger the callback when CSI has been received
             from all sensors on all boards. If :code:`calibrated` is true (default), callback is provided CSI that is already phase-calibrated.
+
+        Note: :class:`.ClusteredCSI` objects are recycled for later packets once they have been removed from the cache.
+        Callbacks must copy any data they want to keep instead of holding on to the :class:`.ClusteredCSI` object or the arrays it returns.
         """
         self.callbacks.append(_CSICallback(cb, cb_predicate))
 
@@ -552,47 +652,15 @@ class Pool(object):
         self.logger.info("Finished calibration")
         self.set_calib(False)
 
-        channel_primary = None
-        channel_secondary = None
+        channel_primary, channel_secondary = self._calibration_channels()
 
         # Collect calibration packets and compute calibration phases
         if per_board:
-            phase_calibrations_lltf = []
-            phase_calibrations_ht40 = []
-            timestamp_calibrations = []
-
-            for board_num, board in enumerate(self.boards):
-                complete_clusters_lltf = []
-                complete_clusters_ht40 = []
-                timestamp_offsets = []
-
-                any_csi_count = 0
-                for cluster in self.cluster_cache_calib.values():
-                    if channel_primary is None:
-                        channel_primary = cluster.get_primary_channel()
-                        channel_secondary = cluster.get_secondary_channel()
-                    else:
-                        assert(channel_primary == cluster.get_primary_channel())
-                        assert(channel_secondary == cluster.get_secondary_channel())
-
-                    completion = cluster.get_completion()[board_num]
-                    if np.any(completion):
-                        any_csi_count = any_csi_count + 1
-
-                    if np.all(completion):
-                        complete_clusters_lltf.append(cluster.deserialize_csi_lltf()[board_num])
-                        if cluster.is_ht40():
-                            complete_clusters_ht40.append(cluster.deserialize_csi_ht40()[board_num])
-                        timestamp_offsets.append(cluster.get_sensor_timestamps()[board_num] - cluster.get_host_timestamp())
-
-                self.logger.info(f"Board {board.get_name()}: Collected {any_csi_count} calibration clusters, out of which {len(complete_clusters_lltf)} are complete ({len(complete_clusters_ht40)} are HT40)")
-                if len(complete_clusters_lltf) == 0:
-                    raise Exception("ESPARGOS calibration failed, did not receive phase reference signal")
-                if len(complete_clusters_ht40) == 0:
-                    raise Exception("ESPARGOS calibration failed, did not receive any HT40 reference signal, currently not supported. Make sure to use 40MHz wide reference signal for calibration.")
-                phase_calibrations_lltf.append(util.csi_interp_iterative(np.asarray(complete_clusters_lltf)))
-                phase_calibrations_ht40.append(util.csi_interp_iterative(np.asarray(complete_clusters_ht40)))
-                timestamp_calibrations.append(np.mean(np.asarray(timestamp_offsets), axis = 0))
+            # Boards are calibrated independently, and the heavy lifting happens in NumPy, which releases the GIL
+            with ThreadPoolExecutor(max_workers = len(self.boards)) as executor:
+                board_calibrations = list(executor.map(self._calibrate_board, range(len(self.boards))))
+
+            phase_calibrations_lltf, phase_calibrations_ht40, timestamp_calibrations = zip(*board_calibrations)
 
             self.stored_calibration = CSICalibration(channel_primary, channel_secondary, np.asarray(phase_calibrations_lltf), np.asarray(phase_calibrations_ht40), np.asarray(timestamp_calibrations))
 
@@ -602,13 +670,6 @@ class Pool(object):
             timestamp_offsets = []
 
             for cluster in self.cluster_cache_calib.values():
-                if channel_primary is None:
-                    channel_primary = cluster.get_primary_channel()
-                    channel_secondary = cluster.get_secondary_channel()
-                else:
-                    assert(channel_primary == cluster.get_primary_channel())
-                    assert(channel_secondary == cluster.get_secondary_channel())
-
                 completion = cluster.get_completion()
                 if np.all(completion):
                     complete_clusters_lltf.append(cluster.deserialize_csi_lltf())
@@ -627,6 +688,49 @@ class Pool(object):
 
             self.stored_calibration = CSICalibration(channel_primary, channel_secondary, phase_calibrations_lltf, phase_calibration_ht40, time_calibration, board_cable_lengths=cable_lengths, board_cable_vfs=cable_velocity_factors)
 
+    def _calibration_channels(self):
+        # Determine primary and secondary channel of the collected calibration clusters, which must all be the same
+        channel_primary = None
+        channel_secondary = None
+
+        for cluster in self.cluster_cache_calib.values():
+            if channel_primary is None:
+                channel_primary = cluster.get_primary_channel()
+                channel_secondary = cluster.get_secondary_channel()
+            else:
+                assert(channel_primary == cluster.get_primary_channel())
+                assert(channel_secondary == cluster.get_secondary_channel())
+
+        return channel_primary, channel_secondary
+
+    def _calibrate_board(self, board_num: int):
+        # Compute phase and timestamp calibration values for a single board from the collected calibration clusters.
+        # Called concurrently for all boards, so this must only read from the calibration cluster cache.
+        board = self.boards[board_num]
+        complete_clusters_lltf = []
+        complete_clusters_ht40 = []
+        timestamp_offsets = []
+
+        any_csi_count = 0
+        for cluster in self.cluster_cache_calib.values():
+            completion = cluster.get_completion()[board_num]
+            if np.any(completion):
+                any_csi_count = any_csi_count + 1
+
+            if np.all(completion):
+                complete_clusters_lltf.append(cluster.deserialize_csi_lltf()[board_num])
+                if cluster.is_ht40():
+                    complete_clusters_ht40.append(cluster.deserialize_csi_ht40()[board_num])
+                timestamp_offsets.append(cluster.get_sensor_timestamps()[board_num] - cluster.get_host_timestamp())
+
+        self.logger.info(f"Board {board.get_name()}: Collected {any_csi_count} calibration clusters, out of which {len(complete_clusters_lltf)} are complete ({len(complete_clusters_ht40)} are HT40)")
+        if len(complete_clusters_lltf) == 0:
+            raise Exception("ESPARGOS calibration failed, did not receive phase reference signal")
+        if len(complete_clusters_ht40) == 0:
+            raise Exception("ESPARGOS calibration failed, did not receive any HT40 reference signal, currently not supported. Make sure to use 40MHz wide reference signal for calibration.")
+
+        return util.csi_interp_iterative(np.asarray(complete_clusters_lltf)), util.csi_interp_iterative(np.asarray(complete_clusters_ht40)), np.mean(np.asarray(timestamp_offsets), axis = 0)
+
     def get_calibration(self):
         """
         Get the stored calibration values.
@@ -653,9 +757,11 @@ class Pool(object):
         Repeatedly call this function from your main loop or from a separate thread.
         May block for a short amount of time if no data is available.
         """
+        # Only wait if no packets are pending, otherwise packets that arrived in the meantime would be delayed until the next notification.
+        # The boards hold a reference to input_list, so it is drained in place, processing happens outside of the lock.
         with self.input_cond:
-            self.input_cond.wait(timeout = 0.5)
-            packets = [p for p in self.input_list]
+            self.input_cond.wait_for(lambda: len(self.input_list) > 0, timeout = 0.5)
+            packets = self.input_list.copy()
             self.input_list.clear()
 
         self._handle_packets(packets)
@@ -663,46 +769,112 @@ class Pool(object):
     def _handle_packets(self, packets):
         self.stats["packet_backlog"] = len(packets)
 
-        # Deserialize CSI of all packets
-        csi_bufs_int8 = np.zeros((len(packets), ctypes.sizeof(csi.csi_buf_t)), dtype = np.int8)
-        for i, pkt in enumerate(packets):
-            esp_num, serialized_csi, board_num = pkt[0], pkt[1], pkt[2]
-            csi_bufs_int8[i] = serialized_csi.buf
+        # Gather all serialized packets in a single buffer, which is a single memcpy per packet since ctypes structures support the buffer protocol.
+        # Fields that are needed for every packet are then extracted for the whole batch, instead of through ctypes attribute access.
+        serialized_size = ctypes.sizeof(csi.serialized_csi_t)
+        serialized_raw = b"".join([pkt[1] for pkt in packets])
+        serialized_all = np.frombuffer(serialized_raw, dtype = np.uint8).reshape(len(packets), serialized_size)
 
-        # The ESP32 provides CSI as int8_t values in (im, re) pairs (in this order!)
-        # To go from the (re, im) interpretation to (im, re), compute conjugate and multiply by 1.0j.
-        csi_bufs_complex = csi_bufs_int8.astype(np.float32).view(np.complex64)
-        csi_bufs_complex = -1.0j * np.conj(csi_bufs_complex)
+        seq_ctrl_offset = csi.serialized_csi_t.seq_ctrl.offset
+        seq_ctrl_all = serialized_all[:,seq_ctrl_offset].astype(np.uint16) | (serialized_all[:,seq_ctrl_offset + 1].astype(np.uint16) << 8)
+        segs = (seq_ctrl_all >> 4).tolist()
+        frags = (seq_ctrl_all & 0xf).tolist()
+        is_calib_all = serialized_all[:,csi.serialized_csi_t.is_calib.offset].astype(bool).tolist()
+        source_mac_offset = csi.serialized_csi_t.source_mac.offset
+        dest_mac_offset = csi.serialized_csi_t.dest_mac.offset
 
-        for pkt, csi_cplx in zip(packets, csi_bufs_complex):
-            esp_num, serialized_csi, board_num = pkt[0], pkt[1], pkt[2]
+        # Deserialize CSI of all packets
+        buf_offset = csi.serialized_csi_t.buf.offset
+        csi_bufs_int8 = serialized_all[:,buf_offset:buf_offset + ctypes.sizeof(csi.csi_buf_t)].view(np.int8)
 
-            source_mac_str = binascii.hexlify(bytearray(serialized_csi.source_mac)).decode("utf-8")
-            dest_mac_str = binascii.hexlify(bytearray(serialized_csi.dest_mac)).decode("utf-8")
+        # The ESP32 provides CSI as int8_t values in (im, re) pairs (in this order!), convert in a single pass.
+        # add_csi copies the CSI into the cluster, so the scratch buffer can be reused for the next batch.
+        if len(self._csi_scratch) < len(packets):
+            self._csi_scratch = np.empty((max(len(packets), 2 * len(self._csi_scratch)), self._csi_scratch.shape[1]), dtype = np.complex64)
+        csi_bufs_complex = util._deserialize_csi_int8_to_c64(csi_bufs_int8, out = self._csi_scratch[:len(packets)])
 
-            cluster_cache = self.cluster_cache_calib if serialized_csi.is_calib else self.cluster_cache_ota
+        touched_ota = dict()
+        for i, pkt in enumerate(packets):
+            esp_num, serialized_csi, board_num = pkt[0], pkt[1], pkt[2]
 
             # Prepare a cache entry for a new cluster with a different identifier (here: MAC address & sequence control number)
-            cluster_id = f"{source_mac_str}-{dest_mac_str}-{serialized_csi.seq_ctrl.seg:03x}-{serialized_csi.seq_ctrl.frag:01x}"
-            if cluster_id not in cluster_cache:
-                cluster_cache[cluster_id] = ClusteredCSI(source_mac_str, dest_mac_str, serialized_csi.seq_ctrl, len(self.boards))
+            offset = i * serialized_size
+            source_mac = serialized_raw[offset + source_mac_offset:offset + source_mac_offset + 6]
+            dest_mac = serialized_raw[offset + dest_mac_offset:offset + dest_mac_offset + 6]
+            cluster_id = (source_mac, dest_mac, segs[i], frags[i])
+            if is_calib_all[i]:
+                cluster = self.cluster_cache_calib.get(cluster_id)
+                if cluster is None:
+                    cluster = self._new_cluster(cluster_id, serialized_csi.seq_ctrl)
+                    self.cluster_cache_calib[cluster_id] = cluster
+            else:
+                cluster = self._get_ota_cluster(cluster_id, serialized_csi)
+                touched_ota[cluster_id] = cluster
 
             # Add received data for the antenna to the current cluster
-            cluster_cache[cluster_id].add_csi(board_num, esp_num, serialized_csi, csi_cplx)
+            cluster.add_csi(board_num, esp_num, serialized_csi, csi_bufs_complex[i])
 
-        # Check OTA cluster cache for packets where callback is due and for stale packets
-        stale = set()
-        for id in self.cluster_cache_ota.keys():
+        # Check OTA cluster cache for packets where callback is due.
+        # Without predicates, a callback can only become due for clusters that received new CSI,
+        # but predicates may also depend on the age of the cluster, so all clusters need to be checked.
+        if any(cb.cb_predicate is not None for cb in self.callbacks):
+            candidates = list(self.cluster_cache_ota.items())
+        else:
+            candidates = touched_ota.items()
+
+        for id, cluster in candidates:
             all_callbacks_fired = True
             for cb in self.callbacks:
-                all_callbacks_fired = all_callbacks_fired and cb.try_call(self.cluster_cache_ota[id])
+                all_callbacks_fired = all_callbacks_fired and cb.try_call(cluster)
 
             if all_callbacks_fired:
-                stale.add(id)
-
-        for id in self.cluster_cache_ota.keys():
-            if self.cluster_cache_ota[id].get_age() > self.ota_cache_timeout:
-                stale.add(id)
-
-        for id in stale:
-            del self.cluster_cache_ota[id]
\ No newline at end of file
+                self._remove_ota_cluster(id)
+
+        # Clusters are stored in the order in which they were created, so stale clusters are at the front
+        # and the oldest cluster is found in constant time without a separate priority queue.
+        # Compare creation times against a single deadline instead of computing the age of every cluster.
+        stale_deadline = time.time() - self.ota_cache_timeout
+        while len(self.cluster_cache_ota) > 0:
+            id, cluster = next(iter(self.cluster_cache_ota.items()))
+            if cluster.get_host_timestamp() >= stale_deadline:
+                break
+
+            self._remove_ota_cluster(id)
+
+    def _new_cluster(self, cluster_id, seq_ctrl):
+        # MAC addresses are only converted to strings once per cluster
+        if len(self._cluster_freelist) > 0:
+            cluster = self._cluster_freelist.pop()
+            cluster.reset(cluster_id[0].hex(), cluster_id[1].hex(), seq_ctrl)
+            return cluster
+
+        return ClusteredCSI(cluster_id[0].hex(), cluster_id[1].hex(), seq_ctrl, len(self.boards))
+
+    def _get_ota_cluster(self, cluster_id, serialized_csi):
+        # Fast path: Cluster is in the direct-mapped lookup table, indexed by sequence number
+        slot = cluster_id[2] & (_OTA_RING_SIZE - 1)
+        entry = self._ota_ring[slot]
+        if entry is not None and entry[0] == cluster_id:
+            return entry[1]
+
+        # Slow path: Cluster is not in the lookup table (new cluster or collision), look it up in the cache or create it
+        cluster = self.cluster_cache_ota.get(cluster_id)
+        if cluster is None:
+            cluster = self._new_cluster(cluster_id, serialized_csi.seq_ctrl)
+            self.cluster_cache_ota[cluster_id] = cluster
+
+        self._ota_ring[slot] = (cluster_id, cluster)
+        return cluster
+
+    def _remove_ota_cluster(self, cluster_id):
+        cluster = self.cluster_cache_ota.pop(cluster_id)
+        slot = cluster.seq_ctrl.seg & (_OTA_RING_SIZE - 1)
+        entry = self._ota_ring[slot]
+        if entry is not None and entry[1] is cluster:
+            self._ota_ring[slot] = None
+
+        # Keep cluster for reuse, callbacks must not regard it as fired once it holds a different packet
+        if len(self._cluster_freelist) < _CLUSTER_FREELIST_SIZE:
+            for cb in self.callbacks:
+                cb.fired.pop(cluster, None)
+            self._cluster_freelist.append(cluster)
\ No newline at end of file
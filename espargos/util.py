@@ -1,12 +1,69 @@
 #!/usr/bin/env python3
 
 import numpy as np
+import functools
 import yaml
 
 from . import constants
 from . import csi
 
 
+def _conj_unit_phasor_inplace(values: np.ndarray) -> np.ndarray:
+	"""
+	Compute :code:`np.exp(-1.0j * np.angle(values))` as :code:`np.conj(values) / np.abs(values)`, which avoids the trigonometric functions.
+	The result overwrites :code:`values`, so that the only temporary is the magnitude.
+
+	:param values: Complex-valued numpy array of arbitrary shape, overwritten with the result
+	:return: :code:`values`, now containing unit-magnitude phasors with the negative phase of the original values, 1 where they were zero
+	"""
+	magnitude = np.abs(values)
+	np.conjugate(values, out = values)
+
+	zero = magnitude == 0
+	if np.any(zero):
+		values[zero] = 1
+		magnitude[zero] = 1
+
+	values /= magnitude
+	return values
+
+def _csi_interp_iterative_batched(csi: np.ndarray, weights: np.ndarray, iterations: int):
+	"""
+	Core of :func:`csi_interp_iterative`, performs independent interpolations for a batch of CSI matrices.
+
+	:param csi: Complex-valued NumPy array of shape (batch, datapoints, values).
+	:param weights: The weights to use for each CSI datapoint, NumPy array of shape (datapoints,).
+	:param iterations: The number of iterations to perform.
+
+	:return: The interpolated CSI data, complex-valued NumPy array of shape (batch, values).
+	"""
+	# Contiguous matrices make both steps plain (batched) matrix-vector products.
+	# This is a view unless the input is non-contiguous, in which case the one-time copy saves strided access in every iteration.
+	csi = np.ascontiguousarray(csi)
+
+	# Phases are kept as unit phasors exp(-1.0j * phi) of the (negative) phase estimates,
+	# which can be computed from the correlations without evaluating np.angle and np.exp
+	phasors = np.ones(csi.shape[:2], dtype = csi.dtype)
+
+	# Buffers are allocated once and reused by all iterations, all in the precision of the CSI
+	# (otherwise the matrix-vector products would have to convert the whole CSI matrix to double precision)
+	batchsize, datapoints, values = csi.shape
+	coefficients = np.empty((batchsize, 1, datapoints), dtype = csi.dtype)
+	w = np.zeros((batchsize, 1, values), dtype = csi.dtype)
+	w_conj = np.empty((batchsize, values, 1), dtype = csi.dtype)
+	correlations = np.empty((batchsize, datapoints, 1), dtype = csi.dtype)
+	
+	for i in range(iterations):
+		# Combine weights and phases into one coefficient vector
+		np.multiply(weights, phasors, out = coefficients[:,0,:])
+		np.matmul(coefficients, csi, out = w)
+		np.conjugate(w[:,0,:], out = w_conj[:,:,0])
+		np.matmul(csi, w_conj, out = correlations)
+		phasors = _conj_unit_phasor_inplace(correlations[:,:,0])
+		#err = np.sum([weights[n] * np.linalg.norm(csi[n] - np.exp(1.0j * phi[n]) * w)**2 for n in range(len(csi))])
+
+	return w[:,0,:]
+
 def csi_interp_iterative(csi: np.ndarray, weights: np.ndarray = None, iterations = 10):
 	"""
 	Interpolates CSI data (frequency-domain or time-domain) using an iterative algorithm.
@@ -23,27 +80,22 @@ def csi_interp_iterative(csi: np.ndarray, weights: np.ndarray = None, iterations
 	if weights is None:
 		weights = np.ones(len(csi), dtype = csi.dtype) / len(csi)
 
-	phi = np.zeros_like(weights, dtype = csi.dtype)
-	w = None
-	
-	for i in range(iterations):
-		w = np.einsum("n,n,n...->...", weights, np.exp(-1.0j * phi), csi)
-		phi = np.angle(np.einsum("a,na->n", np.conj(w.flatten()), csi.reshape(len(csi), -1)))
-		#err = np.sum([weights[n] * np.linalg.norm(csi[n] - np.exp(1.0j * phi[n]) * w)**2 for n in range(len(csi))])
-
-	return w
+	# Interpolate as a batch of one matrix of shape (datapoints, values)
+	w = _csi_interp_iterative_batched(np.reshape(csi, (1, len(csi), -1)), weights, iterations)
+	return np.reshape(w, csi.shape[1:])
 
 def csi_interp_iterative_by_array(csi: np.ndarray, weights: np.ndarray = None, iterations = 10):
 	"""
 	Interpolates CSI data (frequency-domain or time-domain) using an iterative algorithm.
 	Same as :func:`csi_interp_iterative`, but assumes that second dimension of :code:`csi` is the antenna array dimension and performs the interpolation for each antenna array separately.
 	"""
-	csi_interp = np.zeros((csi.shape[1], *csi.shape[2:]), dtype = csi.dtype)
-
-	for b in range(csi.shape[1]):
-		csi_interp[b] = csi_interp_iterative(csi[:,b], weights=weights, iterations=iterations)
+	if weights is None:
+		weights = np.ones(len(csi), dtype = csi.dtype) / len(csi)
 
-	return csi_interp
+	# All antenna arrays are interpolated at once as a batch of matrices of shape (datapoints, values), phases are estimated per array
+	csi_by_array = np.swapaxes(np.reshape(csi, csi.shape[:2] + (-1,)), 0, 1)
+	w = _csi_interp_iterative_batched(csi_by_array, weights, iterations)
+	return np.reshape(w, (csi.shape[1], *csi.shape[2:]))
 
 def csi_interp_eigenvec(csi: np.ndarray, weights: np.ndarray = None):
 	"""
@@ -57,38 +109,67 @@ def csi_interp_eigenvec(csi: np.ndarray, weights: np.ndarray = None):
 
 	csi_shape = csi.shape[1:]
 	csi = np.reshape(csi, (csi.shape[0], -1))
-	R = np.einsum("n,na,nb->ab", weights, csi, np.conj(csi))
-
-	# eig is faster than eigh for small matrices like the one here
-	w, v = np.linalg.eig(R)
-	principal = np.argmax(w)
-
-	return np.reshape(v[:, principal], csi_shape)
-
+	# Let einsum pick the contraction order, so that the weighting is applied first and the outer product sum runs as a single GEMM
+	R = np.einsum("n,na,nb->ab", weights, csi, np.conj(csi), optimize = True)
+
+	# Power iteration, starting from the column of R that belongs to the strongest value.
+	# Usually converges quickly since the spectrum is dominated by the principal component.
+	principal = R[:, np.argmax(np.real(np.diag(R)))]
+	converged = False
+	for i in range(100):
+		principal_next = R @ principal
+		norm = np.linalg.norm(principal_next)
+		if norm == 0:
+			break
+
+		principal_next = principal_next / norm
+		converged = np.linalg.norm(principal_next - principal) < 1e-9
+		principal = principal_next
+		if converged:
+			break
+
+	# Fall back to full eigendecomposition if power iteration did not converge, e.g., if the top eigenvalues are close
+	if not converged:
+		# R is Hermitian, eigh returns the eigenvalues in ascending order
+		w, v = np.linalg.eigh(R)
+		principal = v[:, -1]
+
+	# Normalize so that the largest component is real
+	largest = principal[np.argmax(np.abs(principal))]
+	principal = principal * (np.conj(largest) / np.abs(largest))
+
+	return np.reshape(principal, csi_shape)
+
+@functools.lru_cache(maxsize = 16)
 def get_frequencies_ht40(primary_channel: int, secondary_channel: int):
 	"""
 	Returns the frequencies of the subcarriers in an HT40 2.4GHz WiFi channel.
 	:param primary_channel: The primary channel number.
 	:param secondary_channel: The secondary channel number.
-	:return: The frequencies of the subcarriers, in Hz, NumPy array.
+	:return: The frequencies of the subcarriers, in Hz, NumPy array. The result is cached and hence read-only.
 	"""
 	center_primary = constants.WIFI_CHANNEL1_FREQUENCY + constants.WIFI_CHANNEL_SPACING * (primary_channel - 1)
 	center_secondary = constants.WIFI_CHANNEL1_FREQUENCY + constants.WIFI_CHANNEL_SPACING * (secondary_channel - 1)
 	center_ht40 = (center_primary + center_secondary) / 2
 	ht40_subcarrier_count = (csi.csi_buf_t.htltf_lower.size + csi.HT40_GAP_SUBCARRIERS * 2 + csi.csi_buf_t.htltf_higher.size) // 2
 	assert(ht40_subcarrier_count % 2 == 1)
-	return center_ht40 + np.arange(-ht40_subcarrier_count // 2, ht40_subcarrier_count // 2) * constants.WIFI_SUBCARRIER_SPACING
+	frequencies = center_ht40 + np.arange(-ht40_subcarrier_count // 2, ht40_subcarrier_count // 2) * constants.WIFI_SUBCARRIER_SPACING
+	frequencies.flags.writeable = False
+	return frequencies
 
+@functools.lru_cache(maxsize = 16)
 def get_frequencies_lltf(channel: int):
 	"""
 	Returns the frequencies of the subcarriers in an 2.4GHz 802.11g 20MHz wide WiFi channel.
 
 	:param primary_channel: The primary channel number (= primary channel, but there is only one channel).
-	:return: The frequencies of the subcarriers, in Hz, NumPy array.
+	:return: The frequencies of the subcarriers, in Hz, NumPy array. The result is cached and hence read-only.
 	"""
 	center_lltf = constants.WIFI_CHANNEL1_FREQUENCY + constants.WIFI_CHANNEL_SPACING * (channel - 1)
 	lltf_subcarrier_count = csi.csi_buf_t.lltf.size // 2
-	return center_lltf + np.arange(-lltf_subcarrier_count // 2, lltf_subcarrier_count // 2) * constants.WIFI_SUBCARRIER_SPACING
+	frequencies = center_lltf + np.arange(-lltf_subcarrier_count // 2, lltf_subcarrier_count // 2) * constants.WIFI_SUBCARRIER_SPACING
+	frequencies.flags.writeable = False
+	return frequencies
 
 def get_calib_trace_wavelength(frequencies: np.ndarray):
 	"""
@@ -109,6 +190,27 @@ def get_cable_wavelength(frequencies: np.ndarray, velocity_factors: np.ndarray):
 	"""
 	return constants.SPEED_OF_LIGHT / frequencies[np.newaxis, :] * velocity_factors[:, np.newaxis]
 
+def _deserialize_csi_int8_to_c64(csi_int8: np.ndarray, out: np.ndarray = None):
+	"""
+	Convert raw CSI buffers as provided by the ESP32 to complex-valued channel coefficients.
+
+	The ESP32 provides CSI as int8_t values in (im, re) pairs (in this order!).
+	The conversion is equivalent to interpreting the buffer as (re, im) pairs and computing :code:`-1.0j * np.conj(...)`,
+	but writes real and imaginary parts directly, without complex intermediate arrays.
+
+	:param csi_int8: The raw CSI buffers, int8 NumPy array with shape (packets, buffer size).
+	:param out: Optional complex64 NumPy array with shape (packets, buffer size // 2) to write the result to.
+	:return: The complex-valued CSI, complex64 NumPy array with shape (packets, buffer size // 2).
+	"""
+	if out is None:
+		out = np.empty((csi_int8.shape[0], csi_int8.shape[1] // 2), dtype = np.complex64)
+
+	out_float = out.view(np.float32)
+	np.negative(csi_int8[:,1::2], out = out_float[:,0::2], dtype = np.float32)
+	np.negative(csi_int8[:,0::2], out = out_float[:,1::2], dtype = np.float32)
+
+	return out
+
 def interpolate_ht40_gap(csi_ht40: np.ndarray):
 	"""
 	Apply linear interpolation to determine realistic values for the subcarrier channel coefficients in the gap between the bonded channels in an HT40 channel.
@@ -119,10 +221,15 @@ def interpolate_ht40_gap(csi_ht40: np.ndarray):
 	index_left = csi.csi_buf_t.htltf_lower.size // 2 - 1
 	index_right = csi.csi_buf_t.htltf_lower.size // 2 + csi.HT40_GAP_SUBCARRIERS
 	missing_indices = np.arange(index_left + 1, index_right)
-	left = csi_ht40[..., index_left]
-	right = csi_ht40[..., index_right]
+	left = csi_ht40[..., index_left, np.newaxis]
+	right = csi_ht40[..., index_right, np.newaxis]
 	interp = (missing_indices - index_left) / (index_right - index_left)
-	csi_ht40[..., missing_indices] = interp * right[..., np.newaxis] + (1 - interp) * left[..., np.newaxis]
+
+	# Compute left + (right - left) * interp directly in the gap (a view), without temporaries
+	gap = csi_ht40[..., index_left + 1:index_right]
+	np.subtract(right, left, out = gap)
+	gap *= interp
+	gap += left
 
 def interpolate_lltf_gap(csi_lltf: np.ndarray):
 	"""
@@ -136,6 +243,23 @@ def interpolate_lltf_gap(csi_lltf: np.ndarray):
 	missing_index = csi_lltf.shape[-1] // 2
 	csi_lltf[..., missing_index] = (csi_lltf[..., index_left] + csi_lltf[..., index_right]) / 2
 
+@functools.lru_cache(maxsize = 32)
+def _make_shift_vectors(max_delay_taps, search_resolution: int, subcarrier_count: int, dtype = np.complex128):
+	"""
+	Returns the frequency-domain phase ramps used by :func:`shift_to_firstpeak` and :func:`shift_to_firstpeak_sync` to search for the first peak.
+
+	:param max_delay_taps: The maximum number of time taps to shift the CSI data by.
+	:param search_resolution: The number of search points (granularity) to use for the time shift.
+	:param subcarrier_count: The number of subcarriers of the CSI data.
+	:param dtype: The complex data type of the shift vectors.
+	:return: The shift vectors, complex-valued NumPy array of shape (search_resolution, subcarrier_count). The result is cached and hence read-only.
+	"""
+	shifts = np.linspace(-max_delay_taps, 0, search_resolution)
+	subcarrier_range = np.arange(-subcarrier_count // 2, subcarrier_count // 2) + 1
+	shift_vectors = np.exp(1.0j * np.outer(shifts, 2 * np.pi * subcarrier_range / subcarrier_count)).astype(dtype, copy = False)
+	shift_vectors.flags.writeable = False
+	return shift_vectors
+
 def shift_to_firstpeak(csi_datapoints: np.ndarray, max_delay_taps = 3, search_resolution = 40, peak_threshold = 0.4):
 	"""
 	Shifts the CSI data so that the first peak of the channel impulse response is at time 0.
@@ -151,12 +275,18 @@ def shift_to_firstpeak(csi_datapoints: np.ndarray, max_delay_taps = 3, search_re
 	"""
 	# Time-shift all collected CSI so that first "peak" is at time 0
 	# CSI datapoints has shape (datapoints, arrays, rows, columns, subcarriers)
-	shifts = np.linspace(-max_delay_taps, 0, search_resolution)
-	subcarrier_range = np.arange(-csi_datapoints.shape[-1] // 2, csi_datapoints.shape[-1] // 2) + 1
-	shift_vectors = np.exp(1.0j * np.outer(shifts, 2 * np.pi * subcarrier_range / csi_datapoints.shape[-1]))
-	powers_by_delay = np.abs(np.einsum("lbrms,ds->lbrmd", csi_datapoints, shift_vectors))
-	max_peaks = np.max(powers_by_delay, axis = -1)
-	first_peak = np.argmax(powers_by_delay > peak_threshold * max_peaks[:,:,:,:,np.newaxis], axis = -1)
+	shift_vectors = _make_shift_vectors(max_delay_taps, search_resolution, csi_datapoints.shape[-1])
+	# Batched matrix product (datapoints, arrays, rows, columns, subcarriers) x (subcarriers, delays)
+	# The peak search is only a power comparison, single precision is plenty for it
+	# Compare squared magnitudes against the squared threshold, which avoids the square roots
+	# Powers are accumulated in a single buffer, and the threshold is applied to the (small) per-datapoint maxima
+	search_vectors = _make_shift_vectors(max_delay_taps, search_resolution, csi_datapoints.shape[-1], np.complex64)
+	csi_by_delay = csi_datapoints.astype(np.complex64, copy = False) @ search_vectors.T
+	powers_by_delay = np.square(csi_by_delay.real)
+	powers_by_delay += np.square(csi_by_delay.imag)
+	thresholds = np.max(powers_by_delay, axis = -1, keepdims = True)
+	thresholds *= peak_threshold**2
+	first_peak = np.argmax(powers_by_delay > thresholds, axis = -1)
 	shift_to_firstpeak = shift_vectors[first_peak]
 
 	return shift_to_firstpeak * csi_datapoints
@@ -175,16 +305,74 @@ def shift_to_firstpeak_sync(csi_datapoints: np.ndarray, max_delay_taps = 3, sear
 	"""
 	# Time-shift all collected CSI so that first "peak" is at time 0
 	# CSI datapoints has shape (datapoints, arrays, rows, columns, subcarriers)
-	shifts = np.linspace(-max_delay_taps, 0, search_resolution)
-	subcarrier_range = np.arange(-csi_datapoints.shape[-1] // 2, csi_datapoints.shape[-1] // 2) + 1
-	shift_vectors = np.exp(1.0j * np.outer(shifts, 2 * np.pi * subcarrier_range / csi_datapoints.shape[-1]))
-	powers_by_delay = np.sum(np.abs(np.einsum("lbrms,ds->lbrmd", csi_datapoints, shift_vectors))**2, axis = (1, 2, 3))
+	shift_vectors = _make_shift_vectors(max_delay_taps, search_resolution, csi_datapoints.shape[-1])
+	# Batched matrix product (datapoints, antennas, subcarriers) x (subcarriers, delays), then sum up the powers over all antennas
+	csi_by_delay = np.reshape(csi_datapoints, (csi_datapoints.shape[0], -1, csi_datapoints.shape[-1])) @ shift_vectors.T
+	powers_by_delay = np.sum(np.square(csi_by_delay.real) + np.square(csi_by_delay.imag), axis = 1)
 	max_peaks = np.max(powers_by_delay, axis = -1)
 	first_peak = np.argmax(powers_by_delay > peak_threshold * max_peaks[:,np.newaxis], axis = -1)
 	shift_to_firstpeak = shift_vectors[first_peak]
 
 	return shift_to_firstpeak[:,np.newaxis,np.newaxis,np.newaxis,:] * csi_datapoints
 
+def _fb_smooth(R: np.ndarray):
+	"""
+	Turns correlation matrices into forward–backward correlation matrices (FBCM), in place.
+
+	:param R: The correlation matrices, complex-valued NumPy array of shape (..., chunksize, chunksize). Overwritten with the result.
+	:return: The forward–backward correlation matrices, which is :code:`R` itself.
+	"""
+	# The flip is a strided view, only its conjugate needs a temporary
+	R += np.conj(R[...,::-1,::-1])
+	R *= 0.5
+	return R
+
+@functools.lru_cache(maxsize = 16)
+def _make_steering_vectors(chunksize: int, tap_min, tap_max, resolution: int):
+	"""
+	Returns the frequency-domain steering vectors for the delays searched by the MVDR and MUSIC power delay profiles.
+
+	:param chunksize: The number of subcarriers per chunk, i.e., the size of the correlation matrices.
+	:param tap_min: The smallest delay, in taps.
+	:param tap_max: The largest delay, in taps.
+	:param resolution: The number of delays.
+	:return: The steering vectors, complex-valued NumPy array of shape (chunksize, resolution). The result is cached and hence read-only.
+	"""
+	delays_taps = np.linspace(tap_min, tap_max, resolution)
+	# TODO: get rid of magic constant 128
+	steering_vectors = np.exp(-1.0j * 2 * np.pi * np.outer(np.arange(chunksize), delays_taps / 128))
+	steering_vectors.flags.writeable = False
+	return steering_vectors
+
+def _chunk_subcarriers(csi_fdomain: np.ndarray, chunksize: int = None):
+	"""
+	Splits the subcarriers of frequency-domain CSI into chunks of equal size, centered in the band (excess subcarriers on both edges are dropped).
+
+	:param csi_fdomain: The frequency-domain CSI data. Complex-valued NumPy array with shape (..., subcarriers).
+	:param chunksize: The number of subcarriers per chunk. If None, all subcarriers form a single chunk.
+	:return: The chunked CSI data, NumPy array of shape (..., chunks, chunksize). This is a view of :code:`csi_fdomain`, not a copy.
+	"""
+	chunksize = csi_fdomain.shape[-1] if chunksize is None else chunksize
+	chunkcount = csi_fdomain.shape[-1] // chunksize
+	padding = (csi_fdomain.shape[-1] - chunkcount * chunksize) // 2
+
+	# Splitting the (uniformly strided) subcarrier axis never requires a copy, whether csi_fdomain is contiguous or not
+	return np.reshape(csi_fdomain[..., padding:padding + chunkcount * chunksize], csi_fdomain.shape[:-1] + (chunkcount, chunksize))
+
+def _correlation_matrices(csi_chunked: np.ndarray, per_board = False):
+	"""
+	Computes the (unnormalized) correlation matrices of chunked frequency-domain CSI, summed over all datapoints and chunks.
+
+	:param csi_chunked: The chunked CSI data. Complex-valued NumPy array with shape (datapoints, arrays, rows, columns, chunks, chunksize).
+	:param per_board: If True, also sum over all antennas of each board.
+	:return: The correlation matrices, NumPy array of shape (arrays, rows, columns, chunksize, chunksize), or (arrays, chunksize, chunksize) if :code:`per_board` is True.
+	"""
+	# Stack all snapshots that belong to one correlation matrix as the rows of a matrix X,
+	# so that the sum of outer products is a single batched matrix product X^T conj(X) instead of a generic einsum contraction
+	batch_dims = 1 if per_board else 3
+	snapshots = np.reshape(np.moveaxis(csi_chunked, 0, batch_dims), csi_chunked.shape[1:batch_dims + 1] + (-1, csi_chunked.shape[-1]))
+	return np.swapaxes(snapshots, -1, -2) @ np.conj(snapshots)
+
 def fdomain_to_tdomain_pdp_mvdr(csi_fdomain: np.ndarray, chunksize = 36, tap_min = -7, tap_max = 7, resolution = 200):
 	"""
 	Convert frequency-domain CSI data to a time-domain power delay profile (PDP) using the MVDR beamformer.
@@ -193,30 +381,52 @@ def fdomain_to_tdomain_pdp_mvdr(csi_fdomain: np.ndarray, chunksize = 36, tap_min
 	:return: The delays (in taps) and the PDPs of shape (datapoints, arrays, rows, columns, delays), as NumPy arrays.
 	"""
 	# Compute the covariance matrix R
-	chunksize = csi_fdomain.shape[-1] if chunksize is None else chunksize
-	chunkcount = csi_fdomain.shape[-1] // chunksize
-	padding = (csi_fdomain.shape[-1] - chunkcount * chunksize) // 2
-
-	csi_chunked = np.reshape(csi_fdomain[..., padding:padding + chunkcount * chunksize], csi_fdomain.shape[:-1] + (chunkcount, chunksize), order = "C")
-	R = 1 / csi_chunked.shape[0] * np.einsum("dbrmci,dbrmcj->brmij", csi_chunked, np.conj(csi_chunked))
+	csi_chunked = _chunk_subcarriers(csi_fdomain, chunksize)
+	R = 1 / csi_chunked.shape[0] * _correlation_matrices(csi_chunked)
 
 	delays_taps = np.linspace(tap_min, tap_max, resolution)
-	# TODO: get rid of magic constant 128
-	steering_vectors = np.exp(-1.0j * 2 * np.pi * np.outer(np.arange(R.shape[-1]), delays_taps / 128))
+	steering_vectors = _make_steering_vectors(R.shape[-1], tap_min, tap_max, resolution)
 
-	R = (R + np.flip(np.conj(R), axis = (3, 4))) / 2
+	_fb_smooth(R)
 	R = R + 0.1 * np.eye(R.shape[-1])[np.newaxis,np.newaxis,np.newaxis,:,:]
 
-	# Computation using matrix inverse
-	#R_inv = np.linalg.inv(R)
-	#P_mvdr = 1 / np.real(np.einsum("it,brmij,jt->brmt", np.conj(steering_vectors), R_inv, steering_vectors))
-
 	# Computation using matrix solve
-	R_inv_steering_vectors = np.linalg.solve(R, steering_vectors)
-	P_mvdr = 1 / np.real(np.einsum("it,brmit->brmt", np.conj(steering_vectors), R_inv_steering_vectors))
+	#R_inv_steering_vectors = np.linalg.solve(R, steering_vectors)
+	#P_mvdr = 1 / np.real(np.einsum("it,brmit->brmt", np.conj(steering_vectors), R_inv_steering_vectors))
+
+	# Computation using Cholesky decomposition R = L L^H (R is Hermitian positive definite due to diagonal loading), a^H R^-1 a = ||L^-1 a||^2
+	#L_inv_steering_vectors = np.linalg.inv(np.linalg.cholesky(R)) @ steering_vectors
+	#P_mvdr = 1 / np.sum(np.square(L_inv_steering_vectors.real) + np.square(L_inv_steering_vectors.imag), axis = -2)
+
+	# Computation using matrix inverse: For the small correlation matrices here, inverting once and applying the inverse
+	# to all steering vectors with a batched matrix product is fastest
+	R_inv_steering_vectors = np.linalg.inv(R) @ steering_vectors
+	P_mvdr = 1 / np.real(np.sum(np.conj(steering_vectors) * R_inv_steering_vectors, axis = -2))
 
 	return delays_taps, P_mvdr
 
+def _mdl_source_count(eigvals: np.ndarray, M: int, L = 10):
+	"""
+	Estimates the number of sources from the eigenvalues of forward-backward correlation matrices (FBCM) using the Rissanen MDL criterion, as described in
+	Xinrong Li and Kaveh Pahlavan: "Super-resolution TOA estimation with diversity for indoor geolocation" in IEEE Transactions on Wireless Communications
+
+	:param eigvals: The real-valued eigenvalues in descending order, NumPy array of shape (..., eigenvalues).
+	:param M: The number of chunks used for the correlation matrix computation.
+	:param L: The maximum number of sources.
+	:return: The estimated number of sources, NumPy array of shape (...).
+	"""
+	ev = eigvals[...,:L] + 1e-6
+	k = np.arange(ev.shape[-1])
+
+	# Sums over ev[k:L] for all k at once, as reversed cumulative sums
+	log_sums = np.cumsum(np.log(ev)[...,::-1], axis = -1)[...,::-1]
+	sums = np.cumsum(ev[...,::-1], axis = -1)[...,::-1]
+
+	mdl = -M * (L - k) * (log_sums / (L - k) - np.log(sums / (L - k)))
+	mdl = mdl + (1/4) * k * (2 * L - k + 1) * np.log(M)
+
+	return np.argmin(mdl, axis = -1)
+
 def fdomain_to_tdomain_pdp_music(csi_fdomain: np.ndarray, source_count: int = None, chunksize = 36, tap_min = -7, tap_max = 7, resolution = 200):
 	"""
 	Convert frequency-domain CSI data to a time-domain power delay profile (PDP) using MUSIC super-resolution.
@@ -225,49 +435,89 @@ def fdomain_to_tdomain_pdp_music(csi_fdomain: np.ndarray, source_count: int = No
 	:return: The delays (in taps) and the PDPs of shape (datapoints, arrays, rows, columns, delays), as NumPy arrays.
 	"""
 	# Compute the covariance matrix R
-	chunksize = csi_fdomain.shape[-1] if chunksize is None else chunksize
-	chunkcount = csi_fdomain.shape[-1] // chunksize
-	padding = (csi_fdomain.shape[-1] - chunkcount * chunksize) // 2
-
-	csi_chunked = np.reshape(csi_fdomain[..., padding:padding + chunkcount * chunksize], csi_fdomain.shape[:-1] + (chunkcount, chunksize), order = "C")
-	R = 1 / csi_chunked.shape[0] * np.einsum("dbrmci,dbrmcj->brmij", csi_chunked, np.conj(csi_chunked))
+	csi_chunked = _chunk_subcarriers(csi_fdomain, chunksize)
+	chunkcount = csi_chunked.shape[-2]
+	R = 1 / csi_chunked.shape[0] * _correlation_matrices(csi_chunked)
 
 	delays_taps = np.linspace(tap_min, tap_max, resolution)
-	# TODO: get rid of magic constant 128
-	steering_vectors = np.exp(-1.0j * 2 * np.pi * np.outer(np.arange(R.shape[-1]), delays_taps / 128))
+	steering_vectors = _make_steering_vectors(R.shape[-1], tap_min, tap_max, resolution)
 
 	# Use forward–backward correlation matrix (FBCM)
-	R = (R + np.flip(np.conj(R), axis = (3, 4))) / 2
+	_fb_smooth(R)
 
 	eigval, eigvec = np.linalg.eigh(R)
 	eigval = eigval[:,:,:,::-1]
 	eigvec = eigvec[:,:,:,:,::-1]
 
+	if source_count is None:
+		source_count_by_antenna = _mdl_source_count(np.real(eigval), chunkcount)
+	else:
+		source_count_by_antenna = np.full(R.shape[:3], source_count)
+
+	# Antennas with the same number of sources share the noise subspace dimension, so each group is evaluated at once
 	P_music = np.zeros(R.shape[:3] + (resolution,))
-	for array in range(R.shape[0]):
-		for row in range(R.shape[1]):
-			for col in range(R.shape[2]):
-				antenna_source_count = source_count
-				if antenna_source_count is None:
-					# Rissanen MDL for FBCM, as described in
-					# Xinrong Li and Kaveh Pahlavan: "Super-resolution TOA estimation with diversity for indoor geolocation" in IEEE Transactions on Wireless Communications
-					ev = np.real(eigval)[array,row,col,:]
+	for antenna_source_count in np.unique(source_count_by_antenna):
+		antennas = source_count_by_antenna == antenna_source_count
+		Qn = eigvec[antennas][:,:,antenna_source_count:]
+		P_music[antennas] = 1 / np.linalg.norm(np.einsum("acn,cr->anr", np.conj(Qn), steering_vectors), axis = 1)
+
+	return delays_taps, P_music
 
-					# M = number of chunks for autocorrelation matrix computation, L = maximum number of sources
-					M = chunkcount
-					L = 10
-					mdl = np.zeros(L)
+def _polyroots_batched(coeffs: np.ndarray):
+	"""
+	Computes the roots of many polynomials of the same degree at once, like :func:`numpy.roots` does for a single polynomial.
+	The roots are the eigenvalues of the companion matrices, which are all passed to LAPACK in a single batched call.
 
-					for k in range(L):
-						mdl[k] = -M * (L - k) * (np.sum(np.log(ev[k:L] + 1e-6) / (L - k)) - np.log(np.sum(ev[k:L] + 1e-6) / (L - k)))
-						mdl[k] = mdl[k] + (1/4) * k * (2 * L - k + 1) * np.log(M)
+	:param coeffs: The polynomial coefficients, highest power first. NumPy array of shape (..., degree + 1).
+	:return: The roots, NumPy array of shape (..., degree). Polynomials with vanishing highest or lowest coefficient are
+		solved with :func:`numpy.roots` instead, and their roots are padded with NaN.
+	"""
+	degree = coeffs.shape[-1] - 1
+	coeffs_flat = np.reshape(coeffs, (-1, degree + 1))
+	regular = (coeffs_flat[:,0] != 0) & (coeffs_flat[:,-1] != 0)
 
-					antenna_source_count = np.argmin(mdl)
+	roots = np.full(coeffs_flat.shape[:1] + (degree,), np.nan, dtype = np.result_type(coeffs.dtype, np.complex64))
 
-				Qn = eigvec[array,row,col,:,antenna_source_count:]
-				P_music[array,row,col] = 1 / np.linalg.norm(np.einsum("cn,cr->nr", np.conj(Qn), steering_vectors), axis = 0)
+	companions = np.zeros((np.count_nonzero(regular), degree, degree), dtype = coeffs.dtype)
+	companions[:,np.arange(1, degree),np.arange(degree - 1)] = 1
+	companions[:,0,:] = -coeffs_flat[regular,1:] / coeffs_flat[regular,:1]
+	roots[regular] = np.linalg.eigvals(companions)
 
-	return delays_taps, P_music
+	for i in np.flatnonzero(~regular):
+		polyroots = np.roots(coeffs_flat[i])
+		roots[i,:len(polyroots)] = polyroots
+
+	return np.reshape(roots, coeffs.shape[:-1] + (degree,))
+
+@functools.lru_cache(maxsize = 16)
+def _superdiagonal_indices(size: int):
+	"""
+	Returns the flat indices of the elements on and above the main diagonal of a square matrix, ordered by diagonal,
+	together with the positions where each diagonal starts in that order.
+
+	:param size: The size of the square matrix.
+	:return: The flat indices and the start positions, NumPy arrays. The result is cached and hence read-only.
+	"""
+	rows, cols = np.triu_indices(size)
+	order = np.argsort(cols - rows, kind = "stable")
+	indices = rows[order] * size + cols[order]
+	starts = np.searchsorted((cols - rows)[order], np.arange(size))
+	indices.flags.writeable = False
+	starts.flags.writeable = False
+	return indices, starts
+
+def _superdiagonal_sums(matrices: np.ndarray):
+	"""
+	Sums up the elements on each superdiagonal of a batch of square matrices, i.e., computes :code:`np.trace(matrix, offset = diag)` for all
+	diagonals at once.
+
+	:param matrices: The square matrices, NumPy array of shape (..., size, size).
+	:return: The sums over the main diagonal and all superdiagonals, NumPy array of shape (..., size).
+	"""
+	size = matrices.shape[-1]
+	indices, starts = _superdiagonal_indices(size)
+	elements = np.reshape(matrices, matrices.shape[:-2] + (size * size,))[...,indices]
+	return np.add.reduceat(elements, starts, axis = -1)
 
 def estimate_toas_rootmusic(csi_fdomain: np.ndarray, max_source_count = 2, chunksize = 36, per_board_average = False):
 	"""
@@ -280,67 +530,56 @@ def estimate_toas_rootmusic(csi_fdomain: np.ndarray, max_source_count = 2, chunk
 	:return: The estimated ToAs of the LoS paths, in seconds, NumPy array of shape :code:`(boardcount, constants.ROWS_PER_BOARD, constants.ANTENNAS_PER_ROW)`.
 	"""
 	# Compute the covariance matrix R
-	chunksize = csi_fdomain.shape[-1] if chunksize is None else chunksize
-	chunkcount = csi_fdomain.shape[-1] // chunksize
-	padding = (csi_fdomain.shape[-1] - chunkcount * chunksize) // 2
-
-	csi_chunked = np.reshape(csi_fdomain[..., padding:padding + chunkcount * chunksize], csi_fdomain.shape[:-1] + (chunkcount, chunksize), order = "C")
+	csi_chunked = _chunk_subcarriers(csi_fdomain, chunksize)
+	chunkcount = csi_chunked.shape[-2]
 
 	if per_board_average:
 		# Compute R per-board, but add dummy dimensions for row and column
-		R = 1 / (csi_chunked.shape[0] * csi_chunked.shape[2] * csi_chunked.shape[3]) * np.einsum("dbrmci,dbrmcj->bij", csi_chunked, np.conj(csi_chunked))
+		R = 1 / (csi_chunked.shape[0] * csi_chunked.shape[2] * csi_chunked.shape[3]) * _correlation_matrices(csi_chunked, per_board = True)
 		R = R[:,np.newaxis,np.newaxis,:,:]
 	else:
-		R = 1 / csi_chunked.shape[0] * np.einsum("dbrmci,dbrmcj->brmij", csi_chunked, np.conj(csi_chunked))
+		R = 1 / csi_chunked.shape[0] * _correlation_matrices(csi_chunked)
 
 	# Use forward–backward correlation matrix (FBCM)
-	R = (R + np.flip(np.conj(R), axis = (3, 4))) / 2
+	_fb_smooth(R)
 
-	if chunksize > 50:
+	if R.shape[-1] > 50:
 		eigval, eigvec = np.linalg.eig(R)
 	else:
 		eigval, eigvec = np.linalg.eigh(R)
 
+	source_count_by_antenna = np.minimum(_mdl_source_count(np.sort(np.real(eigval), axis = -1)[...,::-1], chunkcount * csi_fdomain.shape[0]), max_source_count)
+
+	# Now that we determined the number of sources via Rissanen MDL criterion,
+	# we can use the root-MUSIC algorithm to estimate the ToAs.
+	# Sort eigenvectors by descending eigenvalue, the noise subspace Qn is spanned by all but the first (source count) of them.
+	# Instead of selecting a different number of columns for each antenna, the signal subspace columns are zeroed.
+	order = np.argsort(np.real(eigval), axis = -1)[...,::-1]
+	eigvec = np.take_along_axis(eigvec, order[...,np.newaxis,:], axis = -1)
+	Qn = eigvec * (np.arange(eigvec.shape[-1]) >= source_count_by_antenna[...,np.newaxis])[...,np.newaxis,:]
+	C = Qn @ np.conj(np.swapaxes(Qn, -1, -2))
+
+	# Polynomial coefficients are the sums over the diagonals of C = Qn Qn^H
+	coeffs = _superdiagonal_sums(C)
+	coeffs_by_antenna = np.concatenate((coeffs[...,:0:-1], coeffs[...,:1], np.conj(coeffs[...,1:])), axis = -1)
+
+	# Find the polynomial roots for all antennas at once
+	roots_by_antenna = _polyroots_batched(coeffs_by_antenna)
+
+	# Only roots inside the unit circle are considered, sorted by descending power
+	root_magnitudes = np.abs(roots_by_antenna)
+	inside = root_magnitudes < 1
+	powers = np.full(root_magnitudes.shape, -np.inf)
+	powers[inside] = 1 / (1 - root_magnitudes[inside])
+	largest_roots = np.argsort(powers, axis = -1)[...,::-1][...,:2]
+
+	# Out of the strongest 2 paths (or only strongest, if only one source exists), pick the earliest one
+	candidates = np.isfinite(np.take_along_axis(powers, largest_roots, axis = -1))
+	candidates &= np.arange(largest_roots.shape[-1]) < np.minimum(source_count_by_antenna, 2)[...,np.newaxis]
+	source_delays = -np.angle(np.take_along_axis(roots_by_antenna, largest_roots, axis = -1)) / (2 * np.pi) / constants.WIFI_SUBCARRIER_SPACING
+	found = np.any(candidates, axis = -1)
 	toas_by_antenna = np.zeros(R.shape[:3])
-	for array in range(R.shape[0]):
-		for row in range(R.shape[1]):
-			for col in range(R.shape[2]):
-				# Rissanen MDL for FBCM, as described in
-				# Xinrong Li and Kaveh Pahlavan: "Super-resolution TOA estimation with diversity for indoor geolocation" in IEEE Transactions on Wireless Communications
-				ev = np.sort(np.real(eigval[array,row,col,:]))[::-1]
-
-				# M = number of chunks for autocorrelation matrix computation, L = maximum number of sources
-				M = chunkcount * csi_fdomain.shape[0]
-				L = 10
-				mdl = np.zeros(L)
-
-				for k in range(L):
-					mdl[k] = -M * (L - k) * (np.sum(np.log(ev[k:L] + 1e-6) / (L - k)) - np.log(np.sum(ev[k:L] + 1e-6) / (L - k)))
-					mdl[k] = mdl[k] + (1/4) * k * (2 * L - k + 1) * np.log(M)
-
-				antenna_source_count = min(np.argmin(mdl), max_source_count)
-
-				# Now that we determined the number of sources via Rissanen MDL criterion,
-				# we can use the root-MUSIC algorithm to estimate the ToAs
-				order = np.argsort(np.real(eigval[array,row,col]))[::-1]
-				Qn = np.asmatrix(eigvec[array,row,col,:,:][:,order][:,antenna_source_count:])
-				C = np.matmul(Qn, Qn.H)
-
-				coeffs = np.asarray([np.trace(C, offset = diag) for diag in range(1, len(C))])
-
-				# Remove some of the smaller noise coefficients, trade accuracy for speed
-				coeffs = np.hstack((coeffs[::-1], np.trace(C), coeffs.conj()))
-
-				roots = np.roots(coeffs)
-				roots = roots[abs(roots) < 1]
-				powers = 1 / (1 - np.abs(roots))
-				largest_roots = np.argsort(powers)[::-1]
-
-				source_delays = -np.angle(roots[largest_roots[:antenna_source_count]]) / (2 * np.pi) / constants.WIFI_SUBCARRIER_SPACING
-			
-				# Out of the strongest 2 paths (or only strongest, if only one source exists), pick the earliest one
-				if len(source_delays) > 0:
-					toas_by_antenna[array,row,col] = np.min(source_delays[:min(antenna_source_count, 2)])
+	toas_by_antenna[found] = np.min(np.where(candidates, source_delays, np.inf), axis = -1)[found]
 
 	# If per-board averaging is enabled, remove dummy dimensions
 	if per_board_average: